@@ -0,0 +1,83 @@
+"""benchmark.py
+
+Measure import time and resident memory of the bot, each scenario being run
+in a fresh interpreter as the bot is restarted often.
+
+Usage: python benchmark.py [revision]
+
+When a revision is given, the same scenarios are also run on a git worktree
+of that revision (e.g. the commit before lazy loading) for comparison.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from ocr import CLASSIFIER_FILE
+
+SCENARIOS = [
+    ("import game", "import game"),
+    # trees without lazy loading already loaded everything on import
+    ("import game, models loaded", "import game, ocr, screen\n"
+                                   "if hasattr(ocr, 'get_classifier'):\n"
+                                   "    ocr.get_classifier()\n"
+                                   "    screen.load_template(screen.TEMPLATE_CARD)\n"
+                                   "    for name, filename in screen.TEMPLATE_COLORS:\n"
+                                   "        screen.load_template(filename)"),
+]
+
+# current resident memory, not the peak given by getrusage
+MEASURE = """
+import os
+import time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+try:
+    import psutil
+    rss = psutil.Process().memory_info().rss
+except ImportError:
+    try:
+        with open("/proc/self/statm") as file:
+            rss = int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, AttributeError, ValueError):
+        rss = float("nan")
+print(elapsed, rss)
+"""
+
+
+def measure(code, folder, repeat=5):
+    times, memories = [], []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, "-c", MEASURE.format(code=code)], cwd=folder,
+                                capture_output=True, text=True, check=True).stdout
+        elapsed, rss = map(float, output.split())
+        times.append(elapsed)
+        memories.append(rss)
+    return min(times), min(memories)
+
+
+def report(label, folder):
+    for name, code in SCENARIOS:
+        elapsed, rss = measure(code, folder)
+        print("{:<10} {:<30} {:8.1f} ms {:8.1f} MB".format(label, name, 1000 * elapsed, rss / 2 ** 20))
+
+
+def report_revision(revision):
+    folder = tempfile.mkdtemp()
+    subprocess.run(["git", "worktree", "add", "--detach", folder, revision], check=True, capture_output=True)
+    try:
+        # the classifier is not versioned, share the current one
+        if os.path.isfile(CLASSIFIER_FILE):
+            shutil.copy(CLASSIFIER_FILE, folder)
+        report(revision, folder)
+    finally:
+        subprocess.run(["git", "worktree", "remove", "--force", folder], check=True, capture_output=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        report_revision(sys.argv[1])
+    report("current", os.getcwd())
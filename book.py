@@ -0,0 +1,181 @@
+"""book.py
+
+Persistent database of solved deals and opening book.
+
+Records are stored as a flat array of fixed-size structures sorted by key, so
+the file can be memory-mapped directly and looked up with a binary search.
+Deals and openings hold a winning line, evaluated positions only a score and
+are kept in a separate compact table.
+"""
+
+import hashlib
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from misc import *
+
+# move kinds, encoded as (kind, a, b, c) bytes
+DRAW = 0
+FOUND_STACK = 1
+FOUND_DECK = 2
+MOVE_DECK = 3
+MOVE_STACK = 4
+
+# game outcomes
+UNKNOWN = 0
+WON = 1
+LOST = 2
+
+# a stored status is only replaced by one of equal or higher priority, indexed by status
+PRIORITY = np.array([0, 2, 1])
+
+MAX_LINE = 256
+
+RECORD = np.dtype([
+    ("key", "<u8"),
+    ("status", "i1"),
+    ("length", "<u2"),
+    ("score", "<f4"),
+    ("line", "u1", (MAX_LINE, 4))
+])
+
+POSITION = np.dtype([
+    ("key", "<u8"),
+    ("score", "<f4")
+])
+
+Entry = namedtuple("Entry", ["status", "score", "line"])
+
+
+def position_key(stacks, hidden=None, foundations=None, stock=None):
+    """Hash a board layout into a 64 bits key.
+
+    Cards are given by their string representation (e.g. "10H"). The stock is
+    only part of the key once all its cards are known.
+    """
+    string = "|".join(" ".join(str(card) for card in stack) for stack in stacks)
+    if hidden is not None:
+        string += "#" + ",".join(map(str, hidden))
+    if foundations is not None:
+        string += "#" + ",".join(map(str, foundations))
+    if stock is not None:
+        string += "#" + " ".join(str(card) for card in stock)
+    digest = hashlib.blake2b(string.encode("ascii"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def opening(line):
+    # moves played before the first draw do not depend on the stock
+    for i, move in enumerate(line):
+        if move[0] == DRAW:
+            return line[:i]
+    return line
+
+
+def search(records, key):
+    keys = records["key"]
+    index = int(np.searchsorted(keys, np.uint64(key)))
+    return index, index < len(keys) and keys[index] == key
+
+
+def load(filename, dtype):
+    if not os.path.isfile(filename) or os.path.getsize(filename) < dtype.itemsize:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode="r")
+
+
+def merge(records, new, priority=None):
+    """Merge new records into sorted records, keeping one record per key.
+
+    The record of highest priority wins, the newest one among equals. Returns
+    the merged records and the number of new records kept.
+    """
+    merged = np.concatenate([records, new])
+    if priority is None:
+        priority = np.zeros(len(merged), int)
+    order = np.lexsort((np.arange(len(merged)), priority, merged["key"]))
+    # the winner of each key comes last in sorted order, hence first once reversed
+    keys, last = np.unique(merged["key"][order][::-1], return_index=True)
+    kept = order[::-1][last]
+    return merged[kept], int((kept >= len(records)).sum())
+
+
+def write(filename, records):
+    temporary = filename + ".tmp"
+    records.tofile(temporary)
+    os.replace(temporary, filename)
+
+
+class Book:
+
+    def __init__(self, filename=BOOK_FILE, positions_filename=POSITIONS_FILE):
+        self.filename = filename
+        self.positions_filename = positions_filename
+        self.records = load(filename, RECORD)
+        self.positions = load(positions_filename, POSITION)
+
+    def __len__(self):
+        return len(self.records)
+
+    def find(self, key):
+        return search(self.records, key)
+
+    def lookup(self, key):
+        index, found = self.find(key)
+        if not found:
+            return None
+        record = self.records[index]
+        line = [tuple(int(x) for x in move) for move in record["line"][:record["length"]]]
+        return Entry(int(record["status"]), float(record["score"]), line)
+
+    def scores(self, keys):
+        # stored position scores, nan for unknown positions
+        keys = np.array(keys, dtype=np.uint64)
+        stored = self.positions["key"]
+        indices = np.minimum(np.searchsorted(stored, keys), max(len(stored) - 1, 0))
+        scores = np.full(len(keys), np.nan)
+        if len(stored) > 0:
+            found = stored[indices] == keys
+            scores[found] = self.positions["score"][indices[found]]
+        return scores
+
+    def store(self, key, status=UNKNOWN, score=np.nan, line=()):
+        return self.update([(key, status, score, line)]) > 0
+
+    def update(self, entries):
+        """Store (key, status, score, line) entries, rewriting the file once.
+
+        A known status is never downgraded: a won deal keeps its winning line
+        unless the new line also wins. Returns the number of stored entries.
+        """
+        new = np.zeros(len(entries), dtype=RECORD)
+        for i, (key, status, score, line) in enumerate(entries):
+            if len(line) > MAX_LINE:
+                raise ValueError("Line too long to be stored ({} moves).".format(len(line)))
+            new["key"][i] = key
+            new["status"][i] = status
+            new["score"][i] = score
+            new["length"][i] = len(line)
+            if len(line) > 0:
+                new["line"][i, :len(line)] = line
+
+        # drop the memory map before rewriting the file (required on Windows)
+        statuses = np.concatenate([self.records["status"], new["status"]])
+        self.records, stored = merge(self.records, new, PRIORITY[statuses])
+        if stored > 0:
+            write(self.filename, self.records)
+        self.records = load(self.filename, RECORD)
+        return stored
+
+    def store_scores(self, entries):
+        """Store (key, score) entries of evaluated positions."""
+        new = np.zeros(len(entries), dtype=POSITION)
+        if len(entries) > 0:
+            new["key"], new["score"] = zip(*entries)
+        self.positions, stored = merge(self.positions, new)
+        if stored > 0:
+            write(self.positions_filename, self.positions)
+        self.positions = load(self.positions_filename, POSITION)
+        return stored
@@ -0,0 +1,110 @@
+"""evaluate.py
+
+Heuristic evaluation of batches of board states.
+
+Boards are encoded as integer arrays so that many candidate states can be
+scored at once. A card is encoded as 4 * (rank - 1) + color + 1, 0 being an
+empty slot.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+MAX_STACK = 19
+
+FEATURES = ("hidden", "foundations", "mobility", "blocked_kings", "buried_low_cards")
+WEIGHTS = np.array([-5., 10., 1., -3., -2.])
+
+Boards = namedtuple("Boards", ["stacks", "hidden", "foundations", "waste"])
+
+
+def card_code(card):
+    return 4 * (card.rank - 1) + card.color + 1
+
+
+def rank_color(codes):
+    return (codes - 1) // 4 + 1, (codes - 1) % 4
+
+
+def encode(states):
+    """Encode a list of (stacks, hidden, foundations, waste) states.
+
+    Stacks hold the face-up cards, waste is the playable deck card or None.
+    """
+    n = len(states)
+    stacks = np.zeros((n, 7, MAX_STACK), np.int16)
+    hidden = np.zeros((n, 7), np.int16)
+    foundations = np.zeros((n, 4), np.int16)
+    waste = np.zeros(n, np.int16)
+    for i, (state_stacks, state_hidden, state_foundations, state_waste) in enumerate(states):
+        for j, stack in enumerate(state_stacks):
+            stacks[i, j, :len(stack)] = [card_code(card) for card in stack]
+        hidden[i] = state_hidden
+        foundations[i] = state_foundations
+        if state_waste is not None:
+            waste[i] = card_code(state_waste)
+    return Boards(stacks, hidden, foundations, waste)
+
+
+def features(boards):
+    stacks, hidden, foundations, waste = boards
+    n = len(stacks)
+    rows = np.arange(n)
+
+    present = stacks > 0
+    ranks, colors = rank_color(stacks)
+    tints = colors >= 2
+    lengths = present.sum(axis=2)
+    depths = lengths[:, :, None] - 1 - np.arange(MAX_STACK)[None, None, :]
+
+    tops = np.take_along_axis(stacks, np.maximum(lengths - 1, 0)[:, :, None], axis=2)[:, :, 0]
+    tops = np.where(lengths > 0, tops, 0)
+    top_ranks, top_colors = rank_color(tops)
+    top_tints = top_colors >= 2
+
+    # face-up cards that can be moved onto the top card of another stack
+    other = ~np.eye(7, dtype=bool)[None, :, None, :]
+    onto = (present[:, :, :, None]
+            & other
+            & (lengths > 0)[:, None, None, :]
+            & (ranks[:, :, :, None] == top_ranks[:, None, None, :] - 1)
+            & (tints[:, :, :, None] != top_tints[:, None, None, :]))
+    mobility = onto.sum(axis=(1, 2, 3))
+
+    # kings that can be moved to an empty stack, unless they already head one
+    movable_kings = present & (ranks == 13) & ~((depths == lengths[:, :, None] - 1) & (hidden == 0)[:, :, None])
+    mobility += movable_kings.sum(axis=(1, 2)) * (lengths == 0).sum(axis=1)
+
+    # top cards that can be sent to foundations
+    top_needed = foundations[rows[:, None], top_colors] + 1
+    mobility += ((lengths > 0) & (top_ranks == top_needed)).sum(axis=1)
+
+    # playable deck card
+    waste_ranks, waste_colors = rank_color(waste)
+    has_waste = waste > 0
+    mobility += (has_waste[:, None]
+                 & (lengths > 0)
+                 & (waste_ranks[:, None] == top_ranks - 1)
+                 & ((waste_colors >= 2)[:, None] != top_tints)).sum(axis=1)
+    mobility += has_waste & (waste_ranks == foundations[rows, waste_colors] + 1)
+
+    # kings lying on hidden cards, which they keep buried
+    blocked_kings = (present[:, :, 0] & (ranks[:, :, 0] == 13) & (hidden > 0)).sum(axis=1)
+
+    # cards soon needed by foundations, weighted by the number of cards on top of them
+    needed = foundations[rows[:, None, None], colors]
+    low = present & (ranks <= needed + 2)
+    buried_low_cards = (low * depths).sum(axis=(1, 2))
+
+    return np.stack([
+        hidden.sum(axis=1),
+        foundations.sum(axis=1),
+        mobility,
+        blocked_kings,
+        buried_low_cards
+    ], axis=1).astype(float)
+
+
+def evaluate(boards, weights=WEIGHTS):
+    return features(boards) @ weights
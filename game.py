@@ -1,7 +1,12 @@
 
 import time
 
+import numpy as np
+
+from book import *
 from directkeys import clic, drag
+from evaluate import WEIGHTS, encode, evaluate
+from ocr import letter_threshold
 from screen import detect_cards, detect_deck
 from misc import *
 
@@ -40,8 +45,10 @@ class Card:
 
 
 class Game:
-    def __init__(self, verbose=True):
+    def __init__(self, verbose=True, weights=WEIGHTS, book=None):
         self.verbose = verbose
+        self.weights = weights
+        self.book = book
         self.deck = []
         self.deck_index = -1
         self.draw_count = 0
@@ -49,8 +56,14 @@ class Game:
         self.stacks = [[], [], [], [], [], [], []]
         self.hidden = [0, 1, 2, 3, 4, 5, 6]
         self.foundations = [0, 0, 0, 0]
-        for stack, letter, color, x, y in detect_cards():
+        self.confidence = 1., 1.
+        for stack, letter, color, x, y in self.scan():
             self.stacks[stack].append(Card(letter, color, (x, y)))
+        self.history = []
+        self.positions = []
+        self.stock = []
+        self.layout = [[str(card) for card in stack] for stack in self.stacks]
+        self.opening_key = position_key(self.layout)
 
     def __str__(self):
         string = ""
@@ -71,6 +84,58 @@ class Game:
         if self.verbose:
             print(message)
 
+    def scan(self):
+        cards, confidence = detect_cards()
+        self.confidence = confidence
+        if self.doubtful(confidence):
+            self.log("Low confidence scan (letter {:.2f}, suit {:.2f}), board may be misread.".format(*confidence))
+        return cards
+
+    @staticmethod
+    def doubtful(confidence):
+        letter_confidence, color_score = confidence
+        return letter_confidence < letter_threshold() or color_score < MIN_COLOR_SCORE
+
+    @property
+    def deal_key(self):
+        if len(self.stock) < 24:
+            return None
+        return position_key(self.layout, stock=self.stock)
+
+    def waste(self):
+        if 0 <= self.deck_index < len(self.deck):
+            return self.deck[self.deck_index]
+        return None
+
+    def state(self):
+        return self.stacks, self.hidden, self.foundations, self.waste()
+
+    def position(self, stacks=None, hidden=None):
+        # cards still to be drawn first, the playable card last
+        stacks = self.stacks if stacks is None else stacks
+        hidden = self.hidden if hidden is None else hidden
+        stock = self.deck[self.deck_index + 1:] + self.deck[:self.deck_index + 1]
+        return position_key(stacks, hidden, self.foundations, stock)
+
+    def scores(self, states):
+        # positions already analysed are read from the book instead of being evaluated
+        if self.book is None:
+            return evaluate(encode(states), self.weights)
+        scores = self.book.scores([self.position(stacks, hidden) for stacks, hidden, foundations, waste in states])
+        missing = np.isnan(scores)
+        if missing.any():
+            scores[missing] = evaluate(encode([state for state, m in zip(states, missing) if m]), self.weights)
+        return scores
+
+    def score(self):
+        return float(self.scores([self.state()])[0])
+
+    def record_position(self):
+        self.positions.append((self.position(), self.score()))
+
+    def won(self):
+        return all(foundation == 13 for foundation in self.foundations)
+
     def draw(self, delay=.3):
         if self.deck_size == 0:
             return False
@@ -81,10 +146,14 @@ class Game:
         clic(1040, 160, 1)
         time.sleep(delay)
         if self.draw_count < 24:
-            letter, color, x, y = detect_deck()
+            letter, color, x, y, confidence = detect_deck()
+            if self.doubtful(confidence):
+                self.log("Low confidence deck card (letter {:.2f}, suit {:.2f}).".format(*confidence))
             self.deck.append(Card(letter, color, (x, y)))
+            self.stock.append(str(self.deck[-1]))
         self.deck_index += 1 % self.deck_size
         self.draw_count += 1
+        self.history.append((DRAW, 0, 0, 0))
         self.log("Drew a card: {}".format(self.deck[self.deck_index]))
         if self.draw_count == 24 and self.verbose:
             print("All cards in deck are known.")
@@ -103,6 +172,7 @@ class Game:
             card = self.stacks[stack][-1]
             if self.found_card(card):
                 self.stacks[stack].pop()
+                self.history.append((FOUND_STACK, stack, 0, 0))
                 time.sleep(delay)
                 return True
         return False
@@ -114,6 +184,7 @@ class Game:
                 self.deck.pop(self.deck_index)
                 self.deck_size -= 1
                 self.deck_index -= 1
+                self.history.append((FOUND_DECK, 0, 0, 0))
                 return True
         return False
 
@@ -122,7 +193,9 @@ class Game:
         for stack in range(7):
             if len(self.stacks[stack]) == 0 and self.hidden[stack] > 0:
                 cards_to_reveal.append(stack)
-        for stack, letter, color, x, y in detect_cards():
+        if len(cards_to_reveal) == 0:
+            return False
+        for stack, letter, color, x, y in self.scan():
             if stack in cards_to_reveal:
                 self.stacks[stack].append(Card(letter, color, (x, y)))
                 self.hidden[stack] -= 1
@@ -134,6 +207,7 @@ class Game:
         drag(card.location[0], card.location[1], STACKS_VERTICALS[target], self.stacks[target][-1].location[1])
         self.stacks[target] += self.stacks[source][source_index:]
         self.stacks[source] = self.stacks[source][:source_index]
+        self.history.append((MOVE_STACK, source, source_index, target))
 
     def move_deck(self, target):
         self.log("Moving deck card to {}".format(target))
@@ -143,16 +217,83 @@ class Game:
         self.deck.pop(self.deck_index)
         self.deck_size -= 1
         self.deck_index -= 1
+        self.history.append((MOVE_DECK, target, 0, 0))
 
-    def find_stack_move(self, source):
+    def legal(self, move):
+        kind, a, b, c = move
+        waste = self.waste()
+        if kind == DRAW:
+            return self.deck_size > 0
+        elif kind == FOUND_STACK:
+            return a < 7 and len(self.stacks[a]) > 0 and \
+                self.stacks[a][-1].rank == self.foundations[self.stacks[a][-1].color] + 1
+        elif kind == FOUND_DECK:
+            return waste is not None and waste.rank == self.foundations[waste.color] + 1
+        elif kind == MOVE_DECK:
+            return waste is not None and a < 7 and len(self.stacks[a]) > 0 and \
+                waste.can_stack_on(self.stacks[a][-1])
+        elif kind == MOVE_STACK:
+            return a < 7 and c < 7 and a != c and b < len(self.stacks[a]) and len(self.stacks[c]) > 0 and \
+                self.stacks[a][b].can_stack_on(self.stacks[c][-1])
+        return False
+
+    def play(self, move):
+        kind, a, b, c = move
+        if kind == DRAW:
+            self.draw()
+        elif kind == FOUND_STACK:
+            self.found_stack(a)
+        elif kind == FOUND_DECK:
+            self.found_deck()
+        elif kind == MOVE_DECK:
+            self.move_deck(a)
+        elif kind == MOVE_STACK:
+            self.move_stack(self.stacks[a][b], a, b, c)
+
+    def replay(self, line):
+        # stop on the first move that does not fit the board, e.g. when a different card was revealed
+        self.log("Replaying {} known moves.".format(len(line)))
+        for i, move in enumerate(line):
+            if not self.legal(move):
+                self.log("Known line does not match the board, stopping after {} moves.".format(i))
+                return False
+            self.play(move)
+            if move[0] != DRAW:
+                self.reveal()
+        return True
+
+    def find_stack_moves(self, source):
+        moves = []
         for i, source_card in enumerate(self.stacks[source]):
             for target in range(7):
                 if target != source:
                     if len(self.stacks[target]) > 0:
                         target_card = self.stacks[target][-1]
                         if source_card.can_stack_on(target_card):
-                            return source_card, target, i
-        return None
+                            moves.append((source_card, target, i))
+        return moves
+
+    def stack_move_state(self, source, source_index, target):
+        stacks = [list(stack) for stack in self.stacks]
+        stacks[target] += stacks[source][source_index:]
+        stacks[source] = stacks[source][:source_index]
+        hidden = list(self.hidden)
+        if len(stacks[source]) == 0 and hidden[source] > 0:
+            hidden[source] -= 1  # a card will be revealed
+        return stacks, hidden, self.foundations, self.waste()
+
+    def best_stack_move(self):
+        # score the current board and every resulting board at once,
+        # a move is only worth playing if it improves the board
+        moves = [(card, source, target, i) for source in range(7) for card, target, i in self.find_stack_moves(source)]
+        if len(moves) == 0:
+            return None
+        states = [self.state()] + [self.stack_move_state(source, i, target) for card, source, target, i in moves]
+        scores = self.scores(states)
+        best = int(np.argmax(scores[1:]))
+        if scores[1 + best] <= scores[0]:
+            return None
+        return moves[best]
 
     def find_deck_move(self):
         for target in range(7):
@@ -163,9 +304,25 @@ class Game:
 
 
 if __name__ == "__main__":
-    game = Game()
+    book = Book()
+    game = Game(book=book)
+
+    entry = book.lookup(game.opening_key)
+    if entry is not None:
+        game.replay(opening(entry.line))
+
+    replayed = False
     iterations = 20
-    while iterations > 0:
+    while iterations > 0 and not game.won():
+        game.record_position()
+
+        # once the stock is known, follow a winning line if this deal was already solved
+        if not replayed and game.deal_key is not None:
+            replayed = True
+            entry = book.lookup(game.deal_key)
+            if entry is not None and entry.status == WON and entry.line[:len(game.history)] == game.history:
+                game.replay(entry.line[len(game.history):])
+                continue
 
         for stack in range(7):
             while True:
@@ -183,18 +340,23 @@ if __name__ == "__main__":
             game.move_deck(move)
             game.reveal()
 
-        moved_cards = []
+        # each move strictly improves the score, so runs cannot go back and forth
         while True:
-            moved = False
-            for source in range(7):
-                move = game.find_stack_move(source)
-                if move is not None and str(move[0]) not in moved_cards:
-                    moved_cards.append(str(move[0]))
-                    game.move_stack(move[0], source, move[2], move[1])
-                    moved = True
-            if not moved:
+            move = game.best_stack_move()
+            if move is None:
                 break
+            card, source, target, i = move
+            game.move_stack(card, source, i, target)
+            game.reveal()
 
         iterations -= 1
 
+    status = WON if game.won() else LOST
+    score = game.score()
+    entries = [(game.opening_key, status, score, opening(game.history)[:MAX_LINE])]
+    if game.deal_key is not None and len(game.history) <= MAX_LINE:
+        entries.append((game.deal_key, status, score, game.history))
+    book.update(entries)
+    book.store_scores(game.positions)
+
     print(game)
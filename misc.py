@@ -3,6 +3,13 @@ STACKS_VERTICALS = [1046, 1178, 1307, 1440, 1575, 1704, 1833]
 
 TEMPLATE_FOLDER = "templates"
 SAMPLES_FOLDER = "samples"
+BOOK_FILE = "book.bin"
+POSITIONS_FILE = "positions.bin"
+
+# margin between the two most probable letters, for classifiers trained without calibration
+MIN_LETTER_CONFIDENCE = .5
+# best suit template score, reference captures score above .93
+MIN_COLOR_SCORE = .9
 
 
 def str_card(letter, color):
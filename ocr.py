@@ -1,48 +1,9 @@
-from sklearn.neural_network import MLPClassifier
-import joblib as jb
-
-from PIL import Image
-
-import matplotlib.pyplot as plt
-import pandas as pd
 import numpy as np
 import os
 
-ANNOTATION_FILE = "annotations.csv"
-CLASSIFIER_FILE = "ocr.pkl"
-SAMPLES_FOLDER = "samples"
-
-
-def annotate():
-    # create file if it does not exist
-    if not os.path.isfile(ANNOTATION_FILE):
-        with open(ANNOTATION_FILE, "w") as file:
-            file.write("file,letter")
-
-    df = pd.read_csv(ANNOTATION_FILE)
-
-    last_index = df.shape[0]
-    while True:
-        filename = os.path.join(SAMPLES_FOLDER, "{}.png".format(last_index))
-        if not os.path.isfile(filename):
-            break
-
-        # plot
-        plt.title(filename)
-        plt.imshow(Image.open(filename))
-        plt.show(block=False)
-
-        # read input
-        letter = input(filename + "> ")
-
-        # insert into DataFrame
-        df.loc[-1] = [filename, letter]
-        df.index = df.index + 1
-        df = df.sort_index()
-        last_index += 1
+from misc import MIN_LETTER_CONFIDENCE
 
-        # save it
-        df.to_csv(ANNOTATION_FILE, sep=",", index=False)
+CLASSIFIER_FILE = "ocr.pkl"
 
 
 def grey(array):
@@ -65,37 +26,35 @@ def normalize(image):
     return np.ravel(apply_threshold(image))
 
 
-def generate_dataset():
-    annotations = pd.read_csv(ANNOTATION_FILE)
-    features, classes = [], []
-    for index, row in annotations.iterrows():
-        image = np.array(Image.open(row["file"]))
-        features.append(normalize(image))
-        classes.append(row["letter"])
-    return np.array(features), classes
-
-
-def train(train_test_ratio=.9):
-    features, classes = generate_dataset()
-    split = int(train_test_ratio * len(classes))
-    x_train, y_train = features[:split], classes[:split]
-    x_test, y_test = features[split:], classes[split:]
-    clf = MLPClassifier()
-    clf.fit(x_train, y_train)
-    print("Score on test set:", clf.score(x_test, y_test))
-    jb.dump(clf, CLASSIFIER_FILE)
+# the classifier (and sklearn with it) is only loaded on first prediction
+clf = None
+
+
+def get_classifier():
+    global clf
+    if clf is None and os.path.isfile(CLASSIFIER_FILE):
+        import joblib as jb
+        clf = jb.load(CLASSIFIER_FILE)
     return clf
 
 
-clf = None
-if os.path.isfile(CLASSIFIER_FILE):
-    clf = jb.load(CLASSIFIER_FILE)
+def letter_threshold():
+    # calibrated by training.train, see min_confidence_
+    return getattr(get_classifier(), "min_confidence_", MIN_LETTER_CONFIDENCE)
 
 
-def predict(image):
-    return clf.predict([normalize(image)])[0]
+def margins(classifier, features):
+    probabilities = np.sort(classifier.predict_proba(features), axis=1)
+    return probabilities[:, -1] - probabilities[:, -2]
+
 
+def predict_with_confidence(image):
+    # margin between the two most probable letters
+    classifier = get_classifier()
+    probabilities = classifier.predict_proba([normalize(image)])[0]
+    order = np.argsort(-probabilities)
+    return classifier.classes_[order[0]], float(probabilities[order[0]] - probabilities[order[1]])
 
-if __name__ == "__main__":
-    annotate()
-    clf = train(.6)
+
+def predict(image):
+    return predict_with_confidence(image)[0]
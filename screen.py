@@ -4,165 +4,152 @@ Handle screen capture procedures.
 
 """
 
-import glob
 import os
 import time
+from functools import lru_cache
 
 import cv2
-import matplotlib.pyplot as plt
 import numpy as np
 from PIL import Image, ImageGrab
 
-from directkeys import clic
 from misc import *
-from ocr import predict
+from ocr import letter_threshold, predict_with_confidence
 
+# templates are loaded on first use
+TEMPLATE_CARD = "card.png"
+TEMPLATE_COLORS = [
+    ('diamond', "diamond.png"),
+    ('heart', "heart.png"),
+    ('spade', "spade.png"),
+    ('club', "club.png")
+]
 
+BBOX_BOARD = (960, 270, 1920, 1044)
+BBOX_DECK = (1121, 92, 1300, 136)
+
+
+@lru_cache(maxsize=None)
 def load_template(filename):
     im = Image.open(os.path.join(TEMPLATE_FOLDER, filename))
     im.load()
     return np.array(im)
 
 
-TEMPLATE_CARD = load_template("card.png")
-TEMPLATE_SPADE = load_template("spade.png")
-TEMPLATE_CLUB = load_template("club.png")
-TEMPLATE_HEART = load_template("heart.png")
-TEMPLATE_DIAMOND = load_template("diamond.png")
-TEMPLATE_COLORS = [
-    ('diamond', TEMPLATE_DIAMOND),
-    ('heart', TEMPLATE_HEART),
-    ('spade', TEMPLATE_SPADE),
-    ('club', TEMPLATE_CLUB)
-]
+def detect_color(image):
+    # spade and club templates correlate at .96, so the best score is used rather than a margin
+    scores = np.array([
+        cv2.matchTemplate(image, load_template(filename), cv2.TM_CCOEFF_NORMED).max()
+        for name, filename in TEMPLATE_COLORS
+    ])
+    color = int(np.argmax(scores))
+    return color, float(scores[color])
 
-BBOX_BOARD = (960, 270, 1920, 1044)
-BBOX_DECK = (1121, 92, 1300, 136)
 
+def recognize(image_letter, image_color):
+    letter, letter_confidence = predict_with_confidence(image_letter)
+    color, color_score = detect_color(image_color)
+    return letter, color, letter_confidence, color_score
 
-# center of the card.png is relative to BBOX_DECK top left
-def generate_template_card(center=(36, 156), radius=10, filename="card.png"):
-    screen = np.array(ImageGrab.grab(BBOX_BOARD))
-    template = screen[
-               center[1] - radius: center[1] + radius,
-               center[0] - radius: center[0] + radius,
-               :]
-    Image.fromarray(template).save(os.path.join(TEMPLATE_FOLDER, filename))
 
+def rate(candidate, min_letter_confidence, min_color_score):
+    # number of passed gates first, as letter and suit confidences are on different scales
+    letter, color, letter_confidence, color_score = candidate[:4]
+    passed = (letter_confidence >= min_letter_confidence) + (color_score >= min_color_score)
+    return passed, letter_confidence, color_score
 
-def generate_template_colors():
-    for stack, image_letter, image_color, x, y in locate_cards():
-        Image.fromarray(image_color).save(os.path.join(TEMPLATE_FOLDER, "{}.png".format(time.time())))
 
+# (x, y) is the bottom right corner of the letter, relative to BBOX_BOARD
+def grab_card(x, y):
+    roi = np.array(ImageGrab.grab((
+        BBOX_BOARD[0] + x - 22,
+        BBOX_BOARD[1] + y - 22,
+        BBOX_BOARD[0] + x,
+        BBOX_BOARD[1] + y + 17)))
+    return roi[:22, :, :], roi[20:, 2:, :]
 
-def generate_samples(rounds):
-    index = len(glob.glob(os.path.join(SAMPLES_FOLDER, "*.png")))
-    for round in range(rounds):
-        clic(1046, 178, 1)
-        time.sleep(2)
-        for stack, image_letter, image_color, x, y in locate_cards():
-            Image.fromarray(image_letter).save(os.path.join(SAMPLES_FOLDER, "{}.png".format(index)))
-            index += 1
 
+def find_peaks(matches, threshold, margin):
+    # 2-D non-maximum suppression: keep local maxima of a (2 * margin + 1) window
+    kernel = np.ones((2 * margin + 1, 2 * margin + 1), np.uint8)
+    peaks = (matches >= threshold) & (matches == cv2.dilate(matches, kernel))
+    ys, xs = np.nonzero(peaks)
 
-def detect_color(image):
-    def keep_maximum(output):
-        maximum = -1
-        for element in list(output):
-            if element > maximum:
-                maximum = element
-        return maximum
+    # equal maxima within a window (e.g. a flat-topped peak) are all kept by the dilate test:
+    # only the first hit in scan order survives
+    close = (np.abs(xs[:, None] - xs[None, :]) <= margin) & (np.abs(ys[:, None] - ys[None, :]) <= margin)
+    first = ~np.triu(close, k=1).any(axis=0)
+    return xs[first], ys[first]
 
-    color_detection = [
-        (i, keep_maximum(cv2.matchTemplate(image, item[1], cv2.TM_CCOEFF_NORMED)))
-        for i, item in enumerate(TEMPLATE_COLORS)
-    ]
 
-    return sorted(color_detection, key=lambda item: -item[1])[0][0]
+def assign_stacks(xs):
+    # nearest stack position, using the midpoints between sorted positions
+    positions = np.array(STACK_POSITIONS)
+    return np.searchsorted((positions[1:] + positions[:-1]) / 2, xs)
 
 
-def locate_cards(threshold=.95, margin=10, plot=False):
+def locate_cards(threshold=.95, margin=10):
     screen = np.array(ImageGrab.grab(BBOX_BOARD))
 
-    matches = cv2.matchTemplate(screen, TEMPLATE_CARD, cv2.TM_CCOEFF_NORMED)
-    matches_pruned = np.where(matches >= threshold)
+    matches = cv2.matchTemplate(screen, load_template(TEMPLATE_CARD), cv2.TM_CCOEFF_NORMED)
+    xs, ys = find_peaks(matches, threshold, margin)
 
-    # using shape() function to get the dimensions of the image
-    # dimensions = matches.shape
-    # print('The dimension of the input image is (h, w): ', dimensions)
-    # print('matches_pruned: ', matches_pruned)
+    # extract images: X-width, y-height
+    x1s, x2s = xs + 12, xs + 34
+    y1s, y2s = ys - 122, ys - 100
+    inside = y1s >= 0
+    x1s, x2s, y1s, y2s = x1s[inside], x2s[inside], y1s[inside], y2s[inside]
+
+    # detect column, then sort cards from top to bottom within each stack
+    stacks = assign_stacks(x1s)
+    order = np.lexsort((y1s, stacks))
 
     cards = []
-    last_pt = -margin, -margin
-    for pt in zip(*matches_pruned[::-1]):
-        if pt[0] - last_pt[0] >= margin:
-            last_pt = pt
-
-            # extract images: X-width, y-height
-            x1, x2 = pt[0] + 12, pt[0] + 34
-            y1, y2 = pt[1] - 122, pt[1] - 100
-            image_letter = screen[y1:y2, x1:x2, :]
-            image_color = screen[y2 - 2:y2 + 17, x1 + 2:x2, :]
-
-            # print(image_letter)
-            # cv2.imshow('letter', image_letter)
-            # cv2.waitKey(0)
-            # cv2.destroyAllWindows()
-            #
-            # print(image_color)
-            # cv2.imshow('color', image_color)
-            # cv2.waitKey(0)
-            # cv2.destroyAllWindows()
-
-            # detect column
-            min_dist = None
-            stack = None
-            for i, dist in enumerate(map(lambda x: (x - x1) ** 2, STACK_POSITIONS)):
-                if i == 0 or dist < min_dist:
-                    stack = i
-                    min_dist = dist
-
-            if plot:
-                plt.figure()
-                plt.subplot(1, 2, 1)
-                plt.title("stack: {}".format(stack + 1))
-                plt.imshow(image_letter)
-                plt.subplot(1, 2, 2)
-                plt.imshow(image_color)
-                plt.show(block=False)
-
-            cards.append((stack, image_letter, image_color, x2, y2))
+    for stack, x1, x2, y1, y2 in zip(stacks[order], x1s[order], x2s[order], y1s[order], y2s[order]):
+        image_letter = screen[y1:y2, x1:x2, :]
+        image_color = screen[y2 - 2:y2 + 17, x1 + 2:x2, :]
+        cards.append((int(stack), image_letter, image_color, int(x2), int(y2)))
 
     return cards
 
 
-def detect_cards(threshold=.95, margin=10, plot=False):
-    located_cards = locate_cards(threshold, margin)
-    detected_cards = []
+def detect_cards(threshold=.95, margin=10, min_letter_confidence=None,
+                 min_color_score=MIN_COLOR_SCORE, retries=2, delay=.1):
+    if min_letter_confidence is None:
+        min_letter_confidence = letter_threshold()
 
-    for stack, image_letter, image_color, x, y in located_cards:
+    def key(candidate):
+        return rate(candidate, min_letter_confidence, min_color_score)
 
+    located_cards = locate_cards(threshold, margin)
+    best = [recognize(image_letter, image_color) for stack, image_letter, image_color, x, y in located_cards]
+
+    # re-capture only the small region of doubtful cards, waiting once per round for the screen to settle
+    for retry in range(retries):
+        doubtful = [i for i, candidate in enumerate(best) if key(candidate)[0] < 2]
+        if len(doubtful) == 0:
+            break
+        time.sleep(delay)
+        for i in doubtful:
+            stack, image_letter, image_color, x, y = located_cards[i]
+            best[i] = max(best[i], recognize(*grab_card(x, y)), key=key)
+
+    detected_cards = []
+    scan_letter_confidence, scan_color_score = 1., 1.
+    for (stack, image_letter, image_color, x, y), candidate in zip(located_cards, best):
+        letter, color, letter_confidence, color_score = candidate
+        scan_letter_confidence = min(scan_letter_confidence, letter_confidence)
+        scan_color_score = min(scan_color_score, color_score)
         detected_cards.append(
             (stack,
-             predict(image_letter),
-             detect_color(image_color),
+             letter,
+             color,
              x + BBOX_BOARD[0],
              y + BBOX_BOARD[1]))
 
-        if plot:
-            plt.figure()
-            plt.subplot(1, 2, 1)
-            plt.title("stack: {}".format(stack + 1))
-            plt.imshow(image_letter)
-            plt.subplot(1, 2, 2)
-            plt.title(str_card(detected_cards[-1][1], detected_cards[-1][2]))
-            plt.imshow(image_color)
-            plt.show(block=False)
+    return detected_cards, (scan_letter_confidence, scan_color_score)
 
-    return detected_cards
 
-
-def detect_deck(plot=False):
+def grab_deck():
     screen = np.array(ImageGrab.grab(BBOX_DECK))
 
     root = 9, 5
@@ -172,25 +159,28 @@ def detect_deck(plot=False):
         root = 9, 48
     image_letter = screen[root[0]:root[0] + 20, root[1]:root[1] + 21, :]
     image_color = screen[root[0] + 18:root[0] + 35, root[1] + 2:root[1] + 21, :]
-
-    letter, color = predict(image_letter), detect_color(image_color)
-
-    if plot:
-        plt.subplot(1, 2, 1)
-        plt.title("deck")
-        plt.imshow(image_letter)
-        plt.subplot(1, 2, 2)
-        plt.title(str_card(letter, color))
-        plt.imshow(image_color)
-        plt.show()
-
-    return letter, color, BBOX_DECK[0] + root[1] + 21, BBOX_DECK[1] + root[0] + 20
-
-
-if __name__ == "__main__":
-    # generate_template_card()
-    # generate_template_colors()
-    # generate_samples(9)
-    detect_cards(plot=True)
-    # detect_deck(plot=True)
-    plt.show(block=True)
+    return image_letter, image_color, root
+
+
+def detect_deck(min_letter_confidence=None, min_color_score=MIN_COLOR_SCORE, retries=2, delay=.1):
+    if min_letter_confidence is None:
+        min_letter_confidence = letter_threshold()
+
+    def key(candidate):
+        return rate(candidate, min_letter_confidence, min_color_score)
+
+    best = None
+    for retry in range(retries + 1):
+        if retry > 0:
+            time.sleep(delay)
+        image_letter, image_color, root = grab_deck()
+        candidate = recognize(image_letter, image_color) + (root,)
+        if best is None or key(candidate) > key(best):
+            best = candidate
+        if key(best)[0] == 2:
+            break
+
+    # coordinates are those of the attempt the card was read from
+    letter, color, letter_confidence, color_score, root = best
+    return (letter, color, BBOX_DECK[0] + root[1] + 21, BBOX_DECK[1] + root[0] + 20,
+            (letter_confidence, color_score))
@@ -0,0 +1,77 @@
+"""tools.py
+
+Generate templates and samples, and plot what the bot sees on screen.
+
+"""
+
+import glob
+import os
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+from PIL import Image, ImageGrab
+
+from directkeys import clic
+from misc import *
+from screen import BBOX_BOARD, grab_deck, locate_cards, recognize
+
+
+# center of the card.png is relative to BBOX_DECK top left
+def generate_template_card(center=(36, 156), radius=10, filename="card.png"):
+    screen = np.array(ImageGrab.grab(BBOX_BOARD))
+    template = screen[
+               center[1] - radius: center[1] + radius,
+               center[0] - radius: center[0] + radius,
+               :]
+    Image.fromarray(template).save(os.path.join(TEMPLATE_FOLDER, filename))
+
+
+def generate_template_colors():
+    for stack, image_letter, image_color, x, y in locate_cards():
+        Image.fromarray(image_color).save(os.path.join(TEMPLATE_FOLDER, "{}.png".format(time.time())))
+
+
+def generate_samples(rounds):
+    index = len(glob.glob(os.path.join(SAMPLES_FOLDER, "*.png")))
+    for round in range(rounds):
+        clic(1046, 178, 1)
+        time.sleep(2)
+        for stack, image_letter, image_color, x, y in locate_cards():
+            Image.fromarray(image_letter).save(os.path.join(SAMPLES_FOLDER, "{}.png".format(index)))
+            index += 1
+
+
+def plot_cards(threshold=.95, margin=10, detect=True):
+    for stack, image_letter, image_color, x, y in locate_cards(threshold, margin):
+        plt.figure()
+        plt.subplot(1, 2, 1)
+        plt.title("stack: {}".format(stack + 1))
+        plt.imshow(image_letter)
+        plt.subplot(1, 2, 2)
+        if detect:
+            letter, color, letter_confidence, color_score = recognize(image_letter, image_color)
+            plt.title("{} ({:.2f}, {:.2f})".format(str_card(letter, color), letter_confidence, color_score))
+        plt.imshow(image_color)
+        plt.show(block=False)
+
+
+def plot_deck():
+    image_letter, image_color, root = grab_deck()
+    letter, color, letter_confidence, color_score = recognize(image_letter, image_color)
+    plt.subplot(1, 2, 1)
+    plt.title("deck")
+    plt.imshow(image_letter)
+    plt.subplot(1, 2, 2)
+    plt.title("{} ({:.2f}, {:.2f})".format(str_card(letter, color), letter_confidence, color_score))
+    plt.imshow(image_color)
+    plt.show()
+
+
+if __name__ == "__main__":
+    # generate_template_card()
+    # generate_template_colors()
+    # generate_samples(9)
+    plot_cards()
+    # plot_deck()
+    plt.show(block=True)
@@ -0,0 +1,93 @@
+"""training.py
+
+Annotate letter samples and train the OCR classifier.
+
+"""
+
+from sklearn.neural_network import MLPClassifier
+import joblib as jb
+
+from PIL import Image
+
+import matplotlib.pyplot as plt
+import pandas as pd
+import numpy as np
+import os
+
+import ocr
+from ocr import CLASSIFIER_FILE, margins, normalize
+
+ANNOTATION_FILE = "annotations.csv"
+SAMPLES_FOLDER = "samples"
+
+
+def annotate():
+    # create file if it does not exist
+    if not os.path.isfile(ANNOTATION_FILE):
+        with open(ANNOTATION_FILE, "w") as file:
+            file.write("file,letter")
+
+    df = pd.read_csv(ANNOTATION_FILE)
+
+    last_index = df.shape[0]
+    while True:
+        filename = os.path.join(SAMPLES_FOLDER, "{}.png".format(last_index))
+        if not os.path.isfile(filename):
+            break
+
+        # plot
+        plt.title(filename)
+        plt.imshow(Image.open(filename))
+        plt.show(block=False)
+
+        # read input
+        letter = input(filename + "> ")
+
+        # insert into DataFrame
+        df.loc[-1] = [filename, letter]
+        df.index = df.index + 1
+        df = df.sort_index()
+        last_index += 1
+
+        # save it
+        df.to_csv(ANNOTATION_FILE, sep=",", index=False)
+
+
+def generate_dataset():
+    annotations = pd.read_csv(ANNOTATION_FILE)
+    features, classes = [], []
+    for index, row in annotations.iterrows():
+        image = np.array(Image.open(row["file"]))
+        features.append(normalize(image))
+        classes.append(row["letter"])
+    return np.array(features), classes
+
+
+def calibrate(clf, x_test, y_test, percentile=5):
+    # threshold passed by all but the lowest percentile of correctly read letters
+    correct = clf.predict(x_test) == np.array(y_test)
+    if not correct.any():
+        return None
+    return float(np.percentile(margins(clf, x_test[correct]), percentile))
+
+
+def train(train_test_ratio=.9):
+    features, classes = generate_dataset()
+    split = int(train_test_ratio * len(classes))
+    x_train, y_train = features[:split], classes[:split]
+    x_test, y_test = features[split:], classes[split:]
+    clf = MLPClassifier()
+    clf.fit(x_train, y_train)
+    print("Score on test set:", clf.score(x_test, y_test))
+    threshold = calibrate(clf, x_test, y_test)
+    if threshold is not None:
+        clf.min_confidence_ = threshold
+        print("Letter confidence threshold:", threshold)
+    jb.dump(clf, CLASSIFIER_FILE)
+    ocr.clf = clf
+    return clf
+
+
+if __name__ == "__main__":
+    annotate()
+    clf = train(.6)